@@ -1,11 +1,358 @@
 import argparse
+import atexit
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
 import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import warnings
 import requests
 import zipfile
 import io
-import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from packaging import version  # Для работы с версиями
 
+try:
+    # lxml (libxml2) разбирает .nuspec заметно быстрее стандартного ElementTree
+    from lxml import etree as ET
+    USE_LXML = True
+    # .nuspec приходит из сети: сущности не раскрываются, внешние ресурсы не загружаются.
+    # Фильтр tag выполняется в libxml2, и в цикл Python попадают только нужные элементы
+    ITERPARSE_OPTIONS = {
+        'resolve_entities': False,
+        'no_network': True,
+        'huge_tree': False,
+        'tag': ('{*}dependency', '{*}dependencies', '{*}metadata'),
+    }
+except ImportError:
+    # В Python 3 xml.etree.cElementTree лишь псевдоним ElementTree: C-ускоритель
+    # подключается автоматически, но в минимальных сборках его может не быть
+    import xml.etree.ElementTree as ET
+    USE_LXML = False
+    ITERPARSE_OPTIONS = {}
+    try:
+        import _elementtree  # noqa: F401
+    except ImportError:
+        warnings.warn(
+            "C accelerator for xml.etree.ElementTree is unavailable, .nuspec parsing will be slow",
+            RuntimeWarning
+        )
+
+try:
+    # orjson разбирает JSON из bytes напрямую и в несколько раз быстрее стандартного json
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# Маркеры предрелизных версий, проверяемые до дорогого разбора через packaging
+PRERELEASE_RE = re.compile(r'-(?:alpha|beta|rc|preview|pre|dev)', re.IGNORECASE)
+
+# Репозиторий по умолчанию и тип ресурса Flat Container API в его индексе сервисов
+DEFAULT_REPOSITORY_URL = "https://api.nuget.org/v3"
+PACKAGE_BASE_ADDRESS_TYPE = "PackageBaseAddress/3.0.0"
+
+# Шаблоны адресов Flat Container API: (базовый адрес, id пакета в нижнем регистре[, версия])
+FLATCONTAINER_INDEX_URL = "{0}/{1}/index.json".format
+FLATCONTAINER_NUPKG_URL = "{0}/{1}/{2}/{1}.{2}.nupkg".format
+FLATCONTAINER_NUSPEC_URL = "{0}/{1}/{2}/{1}.nuspec".format
+
+# Суффиксы тегов .nuspec в любом пространстве имен ({namespace}dependency)
+DEPENDENCY_TAG_SUFFIX = '}dependency'
+DEPENDENCIES_TAG_SUFFIX = '}dependencies'
+METADATA_TAG_SUFFIX = '}metadata'
+
+# .nuspec больше этого размера разбираются в отдельном процессе, обходя GIL;
+# для типичных файлов в несколько килобайт передача данных между процессами дороже самого разбора
+PROCESS_POOL_THRESHOLD = 64 * 1024
+
+# Строка одного ребра графа в DOT и таблица экранирования кавычек и обратной косой черты в именах
+DOT_EDGE_TEMPLATE = '    "{0}" -> "{1}";\n'
+DOT_ESCAPE_TABLE = str.maketrans({'"': '\\"', '\\': '\\\\'})
+
+# Каталог дискового HTTP-кэша; None отключает кэширование (задается через set_cache_dir)
+CACHE_DIR = None
+
+# Содержимое .nupkg и .nuspec по адресу {id}/{version} неизменно, такие ответы не перепроверяются
+IMMUTABLE_URL_SUFFIXES = ('.nupkg', '.nuspec')
+
+# Срок свежести ответа в заголовке Cache-Control
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+# Порог, после которого скачиваемый nupkg сбрасывается из памяти во временный файл, и размер блока чтения
+SPOOL_MAX_SIZE = 2 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Размер одного Range-запроса к nupkg и полный размер файла в заголовке Content-Range
+RANGE_READ_SIZE = 64 * 1024
+CONTENT_RANGE_RE = re.compile(r'bytes \d+-\d+/(\d+)$')
+
+# Таймауты (соединение, чтение) для всех HTTP-запросов к репозиторию
+REQUEST_TIMEOUT = (3.05, 30)
+
+# Число keep-alive соединений на хост по умолчанию
+DEFAULT_POOL_MAXSIZE = 32
+
+
+def create_session(pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    """
+    Создает HTTP-сессию с пулом keep-alive соединений и повторами при временных ошибках сервера.
+    pool_maxsize должен быть не меньше числа потоков.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    )
+    session.mount("https://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip", "User-Agent": "dep-viz/1"})
+    return session
+
+
+SESSION = create_session()
+
+
+def set_session(session):
+    """
+    Заменяет общую HTTP-сессию модуля, закрывая предыдущую.
+    """
+    global SESSION
+    SESSION.close()
+    SESSION = session
+
+
+@atexit.register
+def _close_session():
+    SESSION.close()
+
+
+def default_cache_dir():
+    """
+    Возвращает каталог кэша по умолчанию: $XDG_CACHE_HOME/konf_dz_2 или ~/.cache/konf_dz_2.
+    Кэш общий для всех рабочих каталогов, из которых запускается визуализатор.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'konf_dz_2')
+
+
+def set_cache_dir(cache_dir):
+    """
+    Включает дисковый HTTP-кэш в указанном каталоге (или отключает его, если cache_dir пуст).
+    """
+    global CACHE_DIR
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        CACHE_DIR = cache_dir
+    else:
+        CACHE_DIR = None
+
+
+def _write_atomic(path, chunks):
+    """
+    Записывает последовательность блоков bytes в файл через временный файл и os.replace,
+    чтобы параллельные потоки не видели частичных данных.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _cache_paths(url):
+    """
+    Возвращает пути к файлам тела и метаданных ответа в дисковом кэше.
+    """
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, key + '.body'), os.path.join(CACHE_DIR, key + '.meta.json')
+
+
+def _max_age(cache_control):
+    """
+    Возвращает срок свежести ответа в секундах из заголовка Cache-Control (0, если кэшировать без проверки нельзя).
+    """
+    if not cache_control or 'no-cache' in cache_control or 'no-store' in cache_control:
+        return 0
+    match = MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else 0
+
+
+def _write_cache_meta(meta_path, url, response, previous_meta=None):
+    """
+    Сохраняет ETag/Last-Modified ответа и момент, до которого он свеж по Cache-Control.
+    Валидаторы, не повторенные в ответе 304, берутся из предыдущих метаданных.
+    """
+    previous_meta = previous_meta or {}
+    meta = {
+        'url': url,
+        'etag': response.headers.get('ETag') or previous_meta.get('etag'),
+        'last_modified': response.headers.get('Last-Modified') or previous_meta.get('last_modified'),
+        'expires_at': time.time() + _max_age(response.headers.get('Cache-Control')),
+    }
+    _write_atomic(meta_path, (json.dumps(meta).encode('utf-8'),))
+
+
+def http_get(url):
+    """
+    Выполняет GET через общую сессию и возвращает (status_code, content).
+    При включенном кэше свежие и неизменяемые ответы отдаются с диска, остальные перепроверяются условным запросом.
+    """
+    if CACHE_DIR is None:
+        response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
+        return response.status_code, response.content
+
+    body_path, meta_path = _cache_paths(url)
+
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(body_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+
+    if meta is not None and (url.endswith(IMMUTABLE_URL_SUFFIXES) or meta.get('expires_at', 0) > time.time()):
+        with open(body_path, 'rb') as f:
+            return 200, f.read()
+
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response = SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304 and meta is not None:
+        # Ответ подтвержден сервером: продлеваем срок свежести
+        _write_cache_meta(meta_path, url, response, meta)
+        with open(body_path, 'rb') as f:
+            return 200, f.read()
+
+    if response.status_code == 200:
+        # Тело пишется раньше метаданных: запись считается валидной только при наличии обоих файлов
+        _write_atomic(body_path, (response.content,))
+        _write_cache_meta(meta_path, url, response)
+
+    return response.status_code, response.content
+
+
+class HttpRangeFile(io.RawIOBase):
+    """
+    Файловый объект только для чтения с произвольным доступом поверх HTTP Range-запросов.
+    Уже полученный конец файла tail отдается из памяти.
+    """
+
+    def __init__(self, url, size, tail=b''):
+        super().__init__()
+        self._url = url
+        self._size = size
+        self._tail = tail
+        self._tail_start = size - len(tail)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        if self._position >= self._size or not len(buffer):
+            return 0
+        if self._position >= self._tail_start:
+            offset = self._position - self._tail_start
+            data = self._tail[offset:offset + len(buffer)]
+        else:
+            end = min(self._position + len(buffer), self._tail_start) - 1
+            headers = {'Range': f'bytes={self._position}-{end}', 'Accept-Encoding': 'identity'}
+            response = SESSION.get(self._url, headers=headers, timeout=REQUEST_TIMEOUT)
+            if response.status_code != 206:
+                raise OSError(f"Range request to {self._url} failed: {response.status_code}")
+            data = response.content
+            if len(data) > end - self._position + 1:
+                raise OSError(f"Range request to {self._url} returned {len(data)} bytes for bytes={self._position}-{end}")
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def _content_range_size(content_range):
+    """
+    Возвращает полный размер файла из заголовка Content-Range или None, если он неизвестен.
+    """
+    match = CONTENT_RANGE_RE.match(content_range or '')
+    return int(match.group(1)) if match else None
+
+
+def _spool_response(response):
+    """
+    Копирует потоковый ответ в SpooledTemporaryFile: небольшие тела остаются в памяти, крупные сбрасываются на диск.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    # iter_content распаковывает Content-Encoding, блоки не накапливаются в памяти
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        body.write(chunk)
+    body.seek(0)
+    return body
+
+
+def http_get_file(url):
+    """
+    Скачивает .nupkg и возвращает (status_code, файловый объект или None при ошибке).
+    """
+    # Первый запрос сразу берет конец архива с центральным каталогом zip. Ответ 206 сообщает
+    # размер файла и поддержку Range, а сервер без поддержки Range отдает файл целиком
+    headers = {'Range': f'bytes=-{RANGE_READ_SIZE}', 'Accept-Encoding': 'identity'}
+    with SESSION.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 200:
+            return 200, _spool_response(response)
+        if response.status_code != 206:
+            return response.status_code, None
+
+        size = _content_range_size(response.headers.get('Content-Range'))
+        tail = response.content
+        if size is not None and len(tail) <= size and not response.headers.get('Content-Encoding'):
+            if len(tail) == size:
+                return 200, io.BytesIO(tail)
+            logger.debug("Reading %s (%s bytes) with range requests", response.url, size)
+            return 200, io.BufferedReader(HttpRangeFile(response.url, size, tail), buffer_size=RANGE_READ_SIZE)
+
+    # Диапазон не согласуется с размером файла: скачиваем его целиком обычным запросом
+    with SESSION.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code != 200:
+            return response.status_code, None
+        return 200, _spool_response(response)
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Visualize .NET package dependencies")
@@ -39,209 +386,448 @@ def parse_arguments():
         required=True,
         help="URL to the NuGet repository (e.g., https://api.nuget.org/v3)"
     )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=8,
+        help="Number of packages fetched concurrently at each depth level"
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=default_cache_dir(),
+        help="Directory for the on-disk HTTP cache (default: ~/.cache/konf_dz_2, empty string disables caching)"
+    )
     return parser.parse_args()
 
 
-def get_flatcontainer_index_url(package_name):
+@functools.lru_cache(maxsize=None)
+def get_package_base_address(repository_url):
+    """
+    Получает адрес Flat Container API из индекса сервисов (service index) репозитория.
+    """
+    if repository_url.endswith('/index.json'):
+        service_index_url = repository_url
+    else:
+        service_index_url = repository_url.rstrip('/') + '/index.json'
+    logger.debug("Fetching service index URL: %s", service_index_url)
+
+    status_code, content = http_get(service_index_url)
+    if status_code != 200:
+        raise Exception(f"Failed to fetch service index {service_index_url}: {status_code}")
+
+    try:
+        data = json_loads(content)
+    except ValueError:
+        raise Exception(f"Invalid JSON response for service index {service_index_url}")
+
+    for resource in data.get('resources', []):
+        if resource.get('@type') == PACKAGE_BASE_ADDRESS_TYPE:
+            package_base_address = resource['@id'].rstrip('/')
+            logger.debug("Package base address: %s", package_base_address)
+            return package_base_address
+
+    raise Exception(f"{PACKAGE_BASE_ADDRESS_TYPE} resource not found in service index {service_index_url}")
+
+
+def get_flatcontainer_index_url(package_id, package_base_address):
     """
     Получает URL для Flat Container API для указанного пакета.
+    Здесь и далее package_id - id пакета, уже приведенный к нижнему регистру.
     """
-    package_lower = package_name.lower()
-    flatcontainer_index_url = f"https://api.nuget.org/v3-flatcontainer/{package_lower}/index.json"
-    return flatcontainer_index_url
+    return FLATCONTAINER_INDEX_URL(package_base_address, package_id)
 
 
-def get_all_versions_flatcontainer(package_name):
+@functools.lru_cache(maxsize=4096)
+def get_all_versions_flatcontainer(package_id, repository_url=DEFAULT_REPOSITORY_URL):
     """
-    Получает все доступные версии пакета из Flat Container API.
+    Получает все доступные версии пакета из Flat Container API по id в нижнем регистре.
+    Результат кэшируется в памяти процесса и возвращается кортежем, чтобы его нельзя было изменить.
     """
-    flatcontainer_index_url = get_flatcontainer_index_url(package_name)
-    print(f"Fetching Flat Container index URL: {flatcontainer_index_url}")  # Отладка
+    flatcontainer_index_url = get_flatcontainer_index_url(package_id, get_package_base_address(repository_url))
+    logger.debug("Fetching Flat Container index URL: %s", flatcontainer_index_url)
 
-    response = requests.get(flatcontainer_index_url)
-    print(f"Response status code: {response.status_code}")  # Отладка
+    status_code, content = http_get(flatcontainer_index_url)
+    logger.debug("Response status code: %s", status_code)
 
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch versions for package {package_name}: {response.status_code}")
+    if status_code != 200:
+        raise Exception(f"Failed to fetch versions for package {package_id}: {status_code}")
 
     try:
-        data = response.json()
-        print(f"Flat Container index data: {data}")  # Отладка
+        data = json_loads(content)
+        # Форматирование всего JSON дорого, поэтому выполняется только при включенном DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Flat Container index data: %s", data)
     except ValueError as e:
-        print(f"Error parsing JSON: {e}")  # Отладка
-        raise Exception(f"Invalid JSON response for package {package_name}")
+        logger.debug("Error parsing JSON: %s", e)
+        raise Exception(f"Invalid JSON response for package {package_id}")
 
     versions = data.get('versions', [])
-    print(f"All available versions (flatcontainer): {versions}")  # Отладка
+    logger.debug("All available versions (flatcontainer): %s", versions)
 
     if not versions:
-        raise Exception(f"No versions found for package {package_name}")
+        raise Exception(f"No versions found for package {package_id}")
 
-    return versions
+    return tuple(versions)
+
+
+def _parse_stable_version(v):
+    """
+    Разбирает строку версии и возвращает объект Version, если версия стабильная, иначе None.
+    Предрелизные версии отсекаются скомпилированным регулярным выражением до разбора.
+    """
+    # Исключаем предрелизные версии по ключевым словам без вызова парсера
+    if PRERELEASE_RE.search(v):
+        logger.debug("Skipping pre-release version (keyword): %s", v)
+        return None
+    try:
+        parsed_version = version.Version(v)
+    except version.InvalidVersion as e:
+        logger.debug("Skipping version '%s' due to parsing error: %s", v, e)
+        return None
+    if parsed_version.is_prerelease:
+        logger.debug("Skipping pre-release version (is_prerelease): %s", v)
+        return None
+    return parsed_version
+
+
+def _max_stable_version(versions):
+    """
+    Находит максимальную стабильную версию полным проходом, без предположений о порядке списка.
+    """
+    best_version_str = None
+    best_version = None
+    for v in versions:
+        parsed_version = _parse_stable_version(v)
+        if parsed_version is not None and (best_version is None or parsed_version > best_version):
+            best_version, best_version_str = parsed_version, v
+    return best_version_str
 
 
 def get_latest_stable_version(versions):
     """
     Выбирает последнюю стабильную версию из списка версий.
-    Фильтрует предрелизные версии на основе наличия ключевых слов и свойства is_prerelease.
+    Flat Container API отдает версии по возрастанию, поэтому список просматривается с конца.
     """
-    stable_versions = []
-    for v in versions:
-        # Исключаем предрелизные версии по ключевым словам
-        if any(pre in v.lower() for pre in ['-beta', '-rc', '-preview', '-dev']):
-            print(f"Skipping pre-release version (keyword): {v}")  # Отладка
-            continue
-        try:
-            parsed_version = version.parse(v)
-            if parsed_version.is_prerelease:
-                print(f"Skipping pre-release version (is_prerelease): {v}")  # Отладка
-                continue
-            stable_versions.append(parsed_version)
-            print(f"Added stable version: {v}")  # Отладка
-        except Exception as e:
-            print(f"Skipping version '{v}' due to parsing error: {e}")  # Отладка
-
-    if not stable_versions:
+    latest_version_str = None
+    for v in reversed(versions):
+        if _parse_stable_version(v) is not None:
+            latest_version_str = v
+            break
+
+    if latest_version_str is None:
         raise Exception("No stable versions found.")
 
-    latest_version = max(stable_versions)
-    latest_version_str = str(latest_version)
-    print(f"Latest stable version: {latest_version_str}")  # Отладка
+    # Проверка порядка полным проходом: нарушение только выводится в журнал и не меняет выбор
+    if logger.isEnabledFor(logging.DEBUG):
+        max_version_str = _max_stable_version(versions)
+        if max_version_str != latest_version_str:
+            logger.warning(
+                "Versions are not in ascending order: last stable is %s, maximum is %s",
+                latest_version_str, max_version_str
+            )
+
+    logger.debug("Latest stable version: %s", latest_version_str)
     return latest_version_str
 
 
-def get_download_url(package_name, version):
+def get_download_url(package_id, version, package_base_address):
     """
     Получает URL для скачивания .nupkg файла через Flat Container API.
     """
-    package_lower = package_name.lower()
-    flatcontainer_download_url = f"https://api.nuget.org/v3-flatcontainer/{package_lower}/{version}/{package_lower}.{version}.nupkg"
-    print(f"Fetching Flat Container download URL: {flatcontainer_download_url}")  # Отладка
+    flatcontainer_download_url = FLATCONTAINER_NUPKG_URL(package_base_address, package_id, version)
+    logger.debug("Fetching Flat Container download URL: %s", flatcontainer_download_url)
     return flatcontainer_download_url
 
 
-def download_nupkg(package_name, version):
+def download_nupkg(package_id, version, package_base_address):
     """
-    Скачивает nupkg файл для данного пакета и версии через Flat Container API.
+    Скачивает nupkg файл для данного пакета и версии через Flat Container API
+    и возвращает файловый объект с его содержимым.
     """
-    download_url = get_download_url(package_name, version)
-    print(f"Downloading nupkg from URL: {download_url}")  # Отладка
-    response = requests.get(download_url)
-    print(f"Download response status code: {response.status_code}")  # Отладка
+    download_url = get_download_url(package_id, version, package_base_address)
+    logger.debug("Downloading nupkg from URL: %s", download_url)
+    status_code, nupkg_file = http_get_file(download_url)
+    logger.debug("Download response status code: %s", status_code)
 
-    if response.status_code == 200:
-        return io.BytesIO(response.content)
+    if status_code == 200:
+        return nupkg_file
     else:
-        raise FileNotFoundError(f"Package {package_name} version {version} not found at {download_url}")
+        raise FileNotFoundError(f"Package {package_id} version {version} not found at {download_url}")
 
 
-def extract_dependencies(nupkg_stream):
+def get_nuspec_url(package_id, version, package_base_address):
     """
-    Извлекает зависимости из .nuspec файла внутри nupkg потока.
+    Получает URL .nuspec файла пакета, который Flat Container API отдает отдельно от nupkg.
     """
-    with zipfile.ZipFile(nupkg_stream) as z:
-        # Найти .nuspec файл
-        nuspec_files = [f for f in z.namelist() if f.endswith('.nuspec')]
-        if not nuspec_files:
-            raise FileNotFoundError(".nuspec file not found in the nupkg")
-        nuspec_content = z.read(nuspec_files[0])
+    return FLATCONTAINER_NUSPEC_URL(package_base_address, package_id, version)
 
-    # Парсинг XML с учетом пространств имен
-    root = ET.fromstring(nuspec_content)
 
-    # Извлечь пространство имен из корневого элемента
-    namespace = ''
-    if root.tag.startswith('{'):
-        namespace = root.tag.split('}')[0].strip('{')
+def fetch_nuspec(package_id, version, package_base_address):
+    """
+    Скачивает только .nuspec файл пакета: он занимает несколько килобайт,
+    тогда как nupkg с бинарными файлами может весить мегабайты.
+    """
+    nuspec_url = get_nuspec_url(package_id, version, package_base_address)
+    logger.debug("Downloading nuspec from URL: %s", nuspec_url)
+    status_code, content = http_get(nuspec_url)
+    logger.debug("Nuspec response status code: %s", status_code)
+
+    if status_code == 200:
+        return content
+    else:
+        raise FileNotFoundError(f"Nuspec for package {package_id} version {version} not found at {nuspec_url}")
 
-    ns = {'ns': namespace} if namespace else {}
 
+def parse_nuspec_dependencies(nuspec_file):
+    """
+    Потоково разбирает .nuspec из файлового объекта и возвращает id всех зависимостей,
+    как сгруппированных по целевым фреймворкам, так и без группы.
+    """
     dependencies = set()  # Используем set для избежания дублирования
-    metadata = root.find('ns:metadata', ns) if namespace else root.find('metadata')
-    if metadata is None:
+    has_metadata = False
+    for _, elem in ET.iterparse(nuspec_file, events=("end",), **ITERPARSE_OPTIONS):
+        # Тег сравнивается по суффиксу, без выделения локального имени:
+        # подходит любое пространство имен схемы nuspec и документ без него
+        tag = elem.tag
+        if tag.endswith(DEPENDENCY_TAG_SUFFIX) or tag == 'dependency':
+            dep_id = elem.get('id')
+            if dep_id:
+                # Одни и те же id встречаются в .nuspec многих пакетов: интернирование оставляет
+                # в графе и кэшах по одному объекту строки на имя
+                dependencies.add(sys.intern(dep_id))
+                logger.debug("Found dependency: %s", dep_id)
+        elif tag.endswith(DEPENDENCIES_TAG_SUFFIX) or tag == 'dependencies':
+            # <dependencies> лежит внутри <metadata> и встречается один раз:
+            # остаток документа (frameworkAssemblies, files и т.д.) разбирать не нужно
+            has_metadata = True
+            break
+        elif tag.endswith(METADATA_TAG_SUFFIX) or tag == 'metadata':
+            has_metadata = True
+
+        elem.clear()
+        if USE_LXML:
+            # Удаляем уже обработанных соседей, чтобы родитель не накапливал пустые элементы
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+    if not has_metadata:
         raise ValueError("Invalid .nuspec format: missing metadata")
 
-    dependencies_node = metadata.find('ns:dependencies', ns) if namespace else metadata.find('dependencies')
-    if dependencies_node is not None:
-        # Обработка групп зависимостей (например, по целевым фреймворкам)
-        groups = dependencies_node.findall('ns:group', ns) if namespace else dependencies_node.findall('group')
-        for group in groups:
-            deps = group.findall('ns:dependency', ns) if namespace else group.findall('dependency')
-            for dep in deps:
-                dep_id = dep.attrib.get('id')
-                if dep_id:
-                    dependencies.add(dep_id)
-                    print(f"Found dependency: {dep_id}")  # Отладка
-        # Обработка зависимостей без группировки
-        deps = dependencies_node.findall('ns:dependency', ns) if namespace else dependencies_node.findall('dependency')
-        for dep in deps:
-            dep_id = dep.attrib.get('id')
-            if dep_id:
-                dependencies.add(dep_id)
-                print(f"Found dependency: {dep_id}")  # Отладка
+    if USE_LXML:
+        # resolve_entities=False лишь оставляет ссылки нераскрытыми: документ с объявлениями сущностей
+        # отклоняется целиком, как в ElementTree, для которого внешние сущности не определены
+        dtd = elem.getroottree().docinfo.internalDTD
+        if dtd is not None and next(dtd.iterentities(), None) is not None:
+            raise ValueError("Invalid .nuspec format: entity declarations are not allowed")
 
     return list(dependencies)
 
 
-def build_dependency_graph(package_name, repository_url, max_depth, current_depth=0, graph=None, visited=None):
-    if graph is None:
-        graph = {}
-    if visited is None:
-        visited = set()
+def extract_dependencies_bytes(nuspec_content):
+    """
+    Извлекает зависимости из содержимого .nuspec, переданного в виде bytes.
+    Функция уровня модуля без общего состояния, поэтому ее можно выполнять в пуле процессов.
+    """
+    try:
+        return parse_nuspec_dependencies(io.BytesIO(nuspec_content))
+    except ET.ParseError as e:
+        # XMLSyntaxError из lxml не сериализуется pickle и не может вернуться из пула процессов
+        raise ValueError(f"Invalid .nuspec: {e}") from None
 
-    if current_depth > max_depth:
-        return graph
-    if package_name.lower() in visited:
-        return graph
 
-    visited.add(package_name.lower())
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
 
-    try:
-        # Получаем все доступные версии пакета
-        versions = get_all_versions_flatcontainer(package_name)
-        # Выбираем последнюю стабильную версию
-        latest_version = get_latest_stable_version(versions)
-        print(f"Processing {package_name} version {latest_version}")
 
-        # Скачиваем nupkg файл
-        nupkg_stream = download_nupkg(package_name, latest_version)
+def _get_parse_pool():
+    """
+    Лениво создает пул процессов для разбора больших .nuspec.
+    Используется spawn: fork процесса с работающими потоками может унаследовать захваченные блокировки.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            atexit.register(_parse_pool.shutdown)
+        return _parse_pool
+
+
+def parse_nuspec_content(nuspec_content):
+    """
+    Разбирает .nuspec в текущем потоке или, если файл большой, в пуле процессов.
+    """
+    if len(nuspec_content) > PROCESS_POOL_THRESHOLD:
+        return _get_parse_pool().submit(extract_dependencies_bytes, nuspec_content).result()
+    return extract_dependencies_bytes(nuspec_content)
+
 
-        # Извлекаем зависимости
+def extract_dependencies(nupkg_stream):
+    """
+    Извлекает зависимости из .nuspec файла внутри nupkg потока.
+    .nuspec читается из архива по мере распаковки, без промежуточной копии в памяти.
+    """
+    with zipfile.ZipFile(nupkg_stream) as z:
+        # Найти .nuspec файл: infolist() отдает уже прочитанный центральный каталог без копирования,
+        # а .nuspec обычно лежит в начале архива, поэтому перебор быстро останавливается
+        nuspec_info = next((info for info in z.infolist() if info.filename.endswith('.nuspec')), None)
+        if nuspec_info is None:
+            raise FileNotFoundError(".nuspec file not found in the nupkg")
+        # Передаем ZipInfo, а не имя, чтобы open не искал запись повторно
+        with z.open(nuspec_info) as nuspec_file:
+            return parse_nuspec_dependencies(nuspec_file)
+
+
+def fetch_nupkg_dependencies(package_id, version, package_base_address):
+    """
+    Извлекает зависимости из nupkg; при включенном кэше они сохраняются на диск под ключом адреса nupkg.
+    """
+    dependencies_path = None
+    if CACHE_DIR is not None:
+        dependencies_path = _cache_paths(get_download_url(package_id, version, package_base_address) + '#dependencies')[0]
+        if os.path.exists(dependencies_path):
+            with open(dependencies_path, 'rb') as f:
+                return [sys.intern(dep_id) for dep_id in json_loads(f.read())]
+
+    with download_nupkg(package_id, version, package_base_address) as nupkg_stream:
         dependencies = extract_dependencies(nupkg_stream)
-        graph[package_name] = dependencies
 
-        # Рекурсивно обрабатываем зависимости
-        for dep in dependencies:
-            build_dependency_graph(dep, repository_url, max_depth, current_depth + 1, graph, visited)
+    if dependencies_path is not None:
+        _write_atomic(dependencies_path, (json.dumps(dependencies).encode('utf-8'),))
+    return dependencies
+
+
+@functools.lru_cache(maxsize=4096)
+def resolve_dependencies(package_id, version, repository_url=DEFAULT_REPOSITORY_URL):
+    """
+    Возвращает зависимости конкретной версии пакета; содержимое {id}/{version} неизменно, поэтому результат кэшируется.
+    """
+    # Адрес Flat Container API определяется один раз и передается в функции сборки URL
+    package_base_address = get_package_base_address(repository_url)
+    try:
+        nuspec_content = fetch_nuspec(package_id, version, package_base_address)
+    except FileNotFoundError as e:
+        # Репозиторий не отдает .nuspec отдельно: извлекаем его из архива nupkg
+        logger.debug("%s, falling back to nupkg", e)
+        return tuple(fetch_nupkg_dependencies(package_id, version, package_base_address))
+
+    return tuple(parse_nuspec_content(nuspec_content))
+
+
+def process_package(package_name, repository_url=DEFAULT_REPOSITORY_URL, package_id=None):
+    """
+    Определяет последнюю стабильную версию пакета и возвращает список ее зависимостей.
+    package_id - имя пакета в нижнем регистре, если вызывающий код уже привел его.
+    """
+    # Id пакетов в NuGet регистронезависимы: имя приводится к нижнему регистру один раз,
+    # чтобы кэши не различали "Newtonsoft.Json" и "newtonsoft.json"
+    if package_id is None:
+        package_id = package_name.lower()
+    # Получаем все доступные версии пакета
+    versions = get_all_versions_flatcontainer(package_id, repository_url)
+    # Выбираем последнюю стабильную версию
+    latest_version = get_latest_stable_version(versions)
+    logger.info("Processing %s version %s", package_name, latest_version)
+
+    return list(resolve_dependencies(package_id, latest_version, repository_url))
+
+
+def _process_package_safe(package, repository_url):
+    """
+    Обертка над process_package для пула потоков: принимает пару (имя, id в нижнем регистре),
+    ошибки выводятся, а вместо зависимостей возвращается None.
+    """
+    package_name, package_id = package
+    try:
+        return process_package(package_name, repository_url, package_id)
     except Exception as e:
-        print(f"Error processing package {package_name}: {e}")
+        logger.error("Error processing package %s: %s", package_name, e)
+        return None
+
+
+def build_dependency_graph(package_name, repository_url, max_depth, max_workers=1):
+    """
+    Строит граф зависимостей обходом в ширину.
+    Все пакеты одного уровня глубины обрабатываются параллельно в пуле из max_workers потоков.
+    """
+    graph = {}
+    # Очередь хранит пары (имя, id в нижнем регистре): имя остается ключом графа,
+    # а id, вычисленный при обнаружении пакета, передается в process_package без повторного lower()
+    package_id = package_name.lower()
+    visited = {package_id}
+    frontier = [(package_name, package_id)]
+    process = functools.partial(_process_package_safe, repository_url=repository_url)
+    # Связанные методы вынесены из внутреннего цикла по ребрам; visited один на весь обход,
+    # а next_frontier создается заново на каждом уровне
+    visited_add = visited.add
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in range(max_depth + 1):
+            if not frontier:
+                break
+            next_frontier = []
+            next_frontier_append = next_frontier.append
+            # map возвращает результаты в порядке frontier, поэтому граф заполняется детерминированно
+            for (name, _), dependencies in zip(frontier, executor.map(process, frontier)):
+                if dependencies is None:
+                    continue
+                graph[name] = dependencies
+                for dep in dependencies:
+                    # Отмечаем пакет посещенным при обнаружении, чтобы не ставить его в очередь повторно
+                    dep_id = dep.lower()
+                    if dep_id not in visited:
+                        visited_add(dep_id)
+                        next_frontier_append((dep, dep_id))
+            frontier = next_frontier
 
     return graph
 
 
+def write_dot(graph, fp):
+    """
+    Записывает Graphviz DOT код графа зависимостей в открытый текстовый файл fp.
+    Строки ребер передаются в writelines генератором, поэтому весь DOT код в памяти не собирается.
+    """
+    edge_line = DOT_EDGE_TEMPLATE.format
+    escape = DOT_ESCAPE_TABLE
+    fp.write("digraph Dependencies {\n")
+    fp.writelines(
+        edge_line(pkg.translate(escape), dep.translate(escape))
+        for pkg, deps in graph.items()
+        for dep in deps
+    )
+    fp.write("}")
+
+
 def generate_dot(graph):
     """
-    Генерирует Graphviz DOT код из графа зависимостей.
+    Генерирует Graphviz DOT код из графа зависимостей в виде строки.
     """
-    dot = "digraph Dependencies {\n"
-    for pkg, deps in graph.items():
-        for dep in deps:
-            dot += f'    "{pkg}" -> "{dep}";\n'
-    dot += "}"
-    return dot
+    buffer = io.StringIO()
+    write_dot(graph, buffer)
+    return buffer.getvalue()
 
 
 def main():
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
     args = parse_arguments()
+    set_cache_dir(args.cache_dir)
+    if args.max_workers > DEFAULT_POOL_MAXSIZE:
+        # Пул соединений должен вмещать все параллельные потоки
+        set_session(create_session(pool_maxsize=args.max_workers))
 
     graph = build_dependency_graph(
         package_name=args.package_name,
         repository_url=args.repository_url,
-        max_depth=args.max_depth
+        max_depth=args.max_depth,
+        max_workers=args.max_workers
     )
 
-    dot_code = generate_dot(graph)
-
     # Создаем папку, если она не существует
     output_dir = os.path.dirname(args.output_path)
     if output_dir and not os.path.exists(output_dir):
@@ -249,10 +835,11 @@ def main():
 
     # Запись DOT кода в указанный файл
     with open(args.output_path, 'w', encoding='utf-8') as f:
-        f.write(dot_code)
+        write_dot(graph, f)
 
-    # Вывод DOT кода на экран
-    print(dot_code)
+    # Вывод DOT кода на экран тем же потоковым способом, без промежуточной строки
+    write_dot(graph, sys.stdout)
+    sys.stdout.write("\n")
 
     # Опционально: вызов Graphviz для генерации изображения
     # import subprocess
@@ -1,18 +1,42 @@
 import unittest
-from unittest.mock import patch, Mock
-from io import BytesIO
+from unittest.mock import patch, Mock, MagicMock
+from io import BytesIO, StringIO
+import os
+import pathlib
+import tempfile
+import dependency_visualizer
 import zipfile  # Добавлен импорт для zipfile
 from dependency_visualizer import (
+    http_get,
+    http_get_file,
+    set_cache_dir,
     get_latest_stable_version,
     extract_dependencies,
+    parse_nuspec_dependencies,
+    parse_nuspec_content,
+    extract_dependencies_bytes,
     build_dependency_graph,
-    generate_dot
+    process_package,
+    resolve_dependencies,
+    get_all_versions_flatcontainer,
+    get_package_base_address,
+    get_nuspec_url,
+    get_download_url,
+    fetch_nupkg_dependencies,
+    generate_dot,
+    write_dot
 )
 from packaging import version
 
 
 class TestDependencyVisualizer(unittest.TestCase):
 
+    def setUp(self):
+        # Кэши модуля живут весь процесс: очищаем их, чтобы тесты не влияли друг на друга
+        get_package_base_address.cache_clear()
+        get_all_versions_flatcontainer.cache_clear()
+        resolve_dependencies.cache_clear()
+
     def test_get_latest_stable_version(self):
         versions = [
             '1.0.0',
@@ -27,6 +51,19 @@ class TestDependencyVisualizer(unittest.TestCase):
         result = get_latest_stable_version(versions)
         self.assertEqual(result, expected)
 
+    @patch('dependency_visualizer.version.Version', wraps=version.Version)
+    def test_get_latest_stable_version_scans_from_end(self, mock_version):
+        versions = ['1.0.0', '1.1.0', '1.2.0', '2.0.0-beta']
+        self.assertEqual(get_latest_stable_version(versions), '1.2.0')
+        # Список упорядочен по возрастанию: разбирается только последняя стабильная версия
+        mock_version.assert_called_once_with('1.2.0')
+
+    def test_get_latest_stable_version_unordered(self):
+        # При уровне DEBUG нарушение порядка версий выводится в журнал
+        with self.assertLogs('dependency_visualizer', level='DEBUG') as logs:
+            get_latest_stable_version(['2.0.0', '1.0.0'])
+        self.assertTrue(any('not in ascending order' in line for line in logs.output))
+
     def test_get_latest_stable_version_no_stable(self):
         versions = [
             '1.0.0-beta',
@@ -59,25 +96,123 @@ class TestDependencyVisualizer(unittest.TestCase):
         expected = ['Newtonsoft.Json', 'Serilog']
         self.assertEqual(set(dependencies), set(expected))
 
+    def test_extract_dependencies_namespaced_groups(self):
+        # Реальные .nuspec объявляют xmlns и группируют зависимости по фреймворкам
+        nuspec_content = '''<?xml version="1.0"?>
+        <package xmlns="http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd">
+          <metadata>
+            <dependencies>
+              <group targetFramework="net45">
+                <dependency id="Newtonsoft.Json" version="12.0.3" />
+              </group>
+              <group targetFramework="netstandard2.0">
+                <dependency id="Newtonsoft.Json" version="12.0.3" />
+                <dependency id="System.Memory" version="4.5.4" />
+              </group>
+              <dependency id="Serilog" version="2.10.0" />
+            </dependencies>
+          </metadata>
+        </package>'''
+
+        mock_nupkg = BytesIO()
+        with zipfile.ZipFile(mock_nupkg, 'w') as z:
+            z.writestr('package.nuspec', nuspec_content)
+        mock_nupkg.seek(0)
+
+        dependencies = extract_dependencies(mock_nupkg)
+        self.assertEqual(sorted(dependencies), ['Newtonsoft.Json', 'Serilog', 'System.Memory'])
+
+    def test_parse_nuspec_dependencies_stops_after_dependencies(self):
+        # Все, что идет после </dependencies>, не читается: даже оборванный документ разбирается
+        nuspec_content = b'''<?xml version="1.0"?>
+        <package>
+          <metadata>
+            <dependencies>
+              <dependency id="Serilog" version="2.10.0" />
+            </dependencies>
+            <frameworkAssemblies>'''
+
+        self.assertEqual(parse_nuspec_dependencies(BytesIO(nuspec_content)), ['Serilog'])
+
+    @patch('dependency_visualizer.get_package_base_address', return_value='https://api.nuget.org/v3-flatcontainer')
+    @patch('dependency_visualizer.get_all_versions_flatcontainer', return_value=('1.0.0',))
+    @patch('dependency_visualizer.fetch_nuspec')
+    def test_build_dependency_graph_rejects_external_entity(self, mock_fetch, *_):
+        # .nuspec со ссылкой на внешнюю сущность отклоняется, и из графа выпадает только этот пакет
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as secret:
+            secret.write('<dependency id="Secret.Package" />')
+        self.addCleanup(os.remove, secret.name)
+        nuspecs = {
+            'root': b'<package><metadata><dependencies>'
+                    b'<dependency id="Evil" /><dependency id="Good" /></dependencies></metadata></package>',
+            'evil': f'''<?xml version="1.0"?>
+                <!DOCTYPE package [<!ENTITY xxe SYSTEM "{pathlib.Path(secret.name).as_uri()}">]>
+                <package><metadata><dependencies>&xxe;</dependencies></metadata></package>
+            '''.strip().encode('utf-8'),
+            'good': b'<package><metadata><dependencies /></metadata></package>',
+        }
+        mock_fetch.side_effect = lambda package_id, version, package_base_address: nuspecs[package_id]
 
+        with self.assertLogs('dependency_visualizer', level='ERROR') as logs:
+            graph = build_dependency_graph('Root', 'https://api.nuget.org/v3', max_depth=2)
+
+        self.assertEqual({name: sorted(deps) for name, deps in graph.items()}, {'Root': ['Evil', 'Good'], 'Good': []})
+        self.assertTrue(any('Evil' in line for line in logs.output))
+
+    def test_parse_nuspec_content_large_in_process_pool(self):
+        # .nuspec больше PROCESS_POOL_THRESHOLD разбирается в пуле процессов с тем же результатом
+        dependency_lines = ''.join(
+            f'<dependency id="Package.{i}" version="1.0.0" />' for i in range(2000)
+        )
+        nuspec_content = (
+            '<?xml version="1.0"?><package><metadata><dependencies>'
+            f'{dependency_lines}</dependencies></metadata></package>'
+        ).encode('utf-8')
+        self.assertGreater(len(nuspec_content), dependency_visualizer.PROCESS_POOL_THRESHOLD)
+        self.addCleanup(self._shutdown_parse_pool)
+
+        result = parse_nuspec_content(nuspec_content)
+
+        self.assertIsNotNone(dependency_visualizer._parse_pool)
+        self.assertEqual(sorted(result), sorted(extract_dependencies_bytes(nuspec_content)))
+        self.assertEqual(len(result), 2000)
+
+    def test_parse_nuspec_content_large_malformed_in_process_pool(self):
+        # Ошибка разбора возвращается из пула процессов как ValueError, а не как ошибка pickle
+        dependency_lines = ''.join(
+            f'<dependency id="Package.{i}" version="1.0.0" />' for i in range(2000)
+        )
+        nuspec_content = f'<?xml version="1.0"?><package><metadata><dependencies>{dependency_lines}'.encode('utf-8')
+        self.assertGreater(len(nuspec_content), dependency_visualizer.PROCESS_POOL_THRESHOLD)
+        self.addCleanup(self._shutdown_parse_pool)
+
+        with self.assertRaises(ValueError):
+            parse_nuspec_content(nuspec_content)
+
+    @staticmethod
+    def _shutdown_parse_pool():
+        if dependency_visualizer._parse_pool is not None:
+            dependency_visualizer._parse_pool.shutdown()
+            dependency_visualizer._parse_pool = None
+
+    @patch('dependency_visualizer.get_package_base_address', return_value='https://api.nuget.org/v3-flatcontainer')
     @patch('dependency_visualizer.get_all_versions_flatcontainer')
-    @patch('dependency_visualizer.download_nupkg')
-    @patch('dependency_visualizer.extract_dependencies')
-    def test_build_dependency_graph(self, mock_extract, mock_download, mock_get_versions):
+    @patch('dependency_visualizer.fetch_nuspec')
+    @patch('dependency_visualizer.parse_nuspec_dependencies')
+    def test_build_dependency_graph(self, mock_parse, mock_fetch, mock_get_versions, _):
         # Настраиваем моки
         mock_get_versions.return_value = ['1.0.0', '1.1.0', '2.0.0']
-        mock_download.return_value = BytesIO(b"fake nupkg content")
-        mock_extract.return_value = ['DepA', 'DepB']
+        mock_fetch.return_value = b"fake nuspec content"
 
         # Допустим, DepA имеет свои зависимости
-        def side_effect_extract(nupkg_stream):
-            if mock_download.call_count == 1:
+        def side_effect_parse(nuspec_file):
+            if mock_fetch.call_count == 1:
                 return ['DepA', 'DepB']
-            elif mock_download.call_count == 2:
+            elif mock_fetch.call_count == 2:
                 return ['DepC']
             return []
 
-        mock_extract.side_effect = side_effect_extract
+        mock_parse.side_effect = side_effect_parse
 
         graph = build_dependency_graph(
             package_name='TestPackage',
@@ -93,6 +228,250 @@ class TestDependencyVisualizer(unittest.TestCase):
         }
 
         self.assertEqual(graph, expected_graph)
+        mock_fetch.assert_any_call('testpackage', '2.0.0', 'https://api.nuget.org/v3-flatcontainer')
+
+    @patch('dependency_visualizer.get_package_base_address', return_value='https://api.nuget.org/v3-flatcontainer')
+    @patch('dependency_visualizer.get_all_versions_flatcontainer')
+    @patch('dependency_visualizer.fetch_nuspec')
+    @patch('dependency_visualizer.download_nupkg')
+    @patch('dependency_visualizer.parse_nuspec_dependencies')
+    def test_process_package_falls_back_to_nupkg(self, mock_parse, mock_download, mock_fetch, mock_get_versions, _):
+        mock_get_versions.return_value = ['1.0.0']
+        mock_fetch.side_effect = FileNotFoundError("nuspec not found")
+        mock_nupkg = BytesIO()
+        with zipfile.ZipFile(mock_nupkg, 'w') as z:
+            z.writestr('testpackage.nuspec', b"fake nuspec content")
+        mock_nupkg.seek(0)
+        mock_download.return_value = mock_nupkg
+        mock_parse.return_value = ['DepA']
+
+        self.assertEqual(process_package('TestPackage'), ['DepA'])
+        mock_download.assert_called_once_with('testpackage', '1.0.0', 'https://api.nuget.org/v3-flatcontainer')
+
+    @patch('dependency_visualizer.get_package_base_address', return_value='https://api.nuget.org/v3-flatcontainer')
+    @patch('dependency_visualizer.fetch_nuspec')
+    @patch('dependency_visualizer.parse_nuspec_dependencies')
+    def test_resolve_dependencies_cached(self, mock_parse, mock_fetch, _):
+        mock_fetch.return_value = b"fake nuspec content"
+        mock_parse.return_value = ['DepA']
+
+        self.assertEqual(resolve_dependencies('testpackage', '1.0.0'), ('DepA',))
+        self.assertEqual(resolve_dependencies('testpackage', '1.0.0'), ('DepA',))
+        mock_fetch.assert_called_once_with('testpackage', '1.0.0', 'https://api.nuget.org/v3-flatcontainer')
+
+    @patch('dependency_visualizer.process_package')
+    def test_build_dependency_graph_parallel(self, mock_process):
+        # Зависимости задаются по имени пакета, поэтому порядок выполнения в потоках не важен
+        dependencies = {
+            'TestPackage': ['DepA', 'DepB'],
+            'DepA': ['DepC', 'depb'],
+            'DepB': ['DepC'],
+            'DepC': ['DepD'],
+        }
+        mock_process.side_effect = lambda name, repository_url, package_id: dependencies.get(name, [])
+
+        graph = build_dependency_graph(
+            package_name='TestPackage',
+            repository_url='https://api.nuget.org/v3',
+            max_depth=2,
+            max_workers=4
+        )
+
+        expected_graph = {
+            'TestPackage': ['DepA', 'DepB'],
+            'DepA': ['DepC', 'depb'],
+            'DepB': ['DepC'],
+            'DepC': ['DepD'],
+        }
+        self.assertEqual(graph, expected_graph)
+        # Каждый пакет обрабатывается ровно один раз, DepD лежит глубже max_depth
+        self.assertEqual(mock_process.call_count, 4)
+        # Id в нижнем регистре вычисляется при обнаружении и передается дальше
+        mock_process.assert_any_call('DepA', 'https://api.nuget.org/v3', 'depa')
+
+    @patch('dependency_visualizer.process_package')
+    def test_build_dependency_graph_deep_chain(self, mock_process):
+        # Цепочка глубже лимита рекурсии Python: обход итеративный и не падает с RecursionError
+        depth = 3000
+        mock_process.side_effect = lambda name, repository_url, package_id: [f'Pkg{int(name[3:]) + 1}']
+
+        graph = build_dependency_graph(
+            package_name='Pkg0',
+            repository_url='https://api.nuget.org/v3',
+            max_depth=depth
+        )
+
+        self.assertEqual(len(graph), depth + 1)
+        self.assertEqual(graph[f'Pkg{depth}'], [f'Pkg{depth + 1}'])
+
+    @patch('dependency_visualizer.http_get')
+    def test_get_package_base_address(self, mock_http_get):
+        mock_http_get.return_value = (200, b'''{
+            "version": "3.0.0",
+            "resources": [
+                {"@id": "https://example.org/query", "@type": "SearchQueryService"},
+                {"@id": "https://example.org/flat/", "@type": "PackageBaseAddress/3.0.0"}
+            ]
+        }''')
+
+        self.assertEqual(get_package_base_address('https://example.org/v3'), 'https://example.org/flat')
+        mock_http_get.assert_called_once_with('https://example.org/v3/index.json')
+        self.assertEqual(
+            get_nuspec_url('test.package', '1.0.0', get_package_base_address('https://example.org/v3')),
+            'https://example.org/flat/test.package/1.0.0/test.package.nuspec'
+        )
+        # Индекс сервисов запрашивается один раз
+        mock_http_get.assert_called_once()
+
+    @patch('dependency_visualizer.http_get')
+    def test_url_builders_do_not_fetch(self, mock_http_get):
+        self.assertEqual(
+            get_download_url('foo', '1.0.0', 'https://example.org/flat'),
+            'https://example.org/flat/foo/1.0.0/foo.1.0.0.nupkg'
+        )
+        mock_http_get.assert_not_called()
+
+    @patch('dependency_visualizer.get_package_base_address', return_value='https://api.nuget.org/v3-flatcontainer')
+    @patch('dependency_visualizer.fetch_nuspec')
+    @patch('dependency_visualizer.parse_nuspec_dependencies')
+    def test_resolve_dependencies_keyword_call(self, mock_parse, mock_fetch, _):
+        mock_fetch.return_value = b"fake nuspec content"
+        mock_parse.return_value = ['DepA']
+
+        self.assertEqual(resolve_dependencies('testpackage', version='1.0.0'), ('DepA',))
+        mock_fetch.assert_called_once_with('testpackage', '1.0.0', 'https://api.nuget.org/v3-flatcontainer')
+
+    @patch('dependency_visualizer.SESSION')
+    def test_http_get_revalidates_cached_response(self, mock_session):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            set_cache_dir(cache_dir)
+            self.addCleanup(set_cache_dir, None)
+            url = 'https://api.nuget.org/v3-flatcontainer/testpackage/index.json'
+
+            mock_session.get.return_value = Mock(
+                status_code=200, content=b'{"versions": ["1.0.0"]}', headers={'ETag': '"abc"'}
+            )
+            self.assertEqual(http_get(url), (200, b'{"versions": ["1.0.0"]}'))
+
+            # Повторный запрос условный, а при 304 тело берется из кэша
+            mock_session.get.return_value = Mock(status_code=304, content=b'', headers={})
+            self.assertEqual(http_get(url), (200, b'{"versions": ["1.0.0"]}'))
+            _, kwargs = mock_session.get.call_args
+            self.assertEqual(kwargs['headers'], {'If-None-Match': '"abc"'})
+
+            # Неизменяемый .nupkg после первой загрузки отдается без обращения к сети
+            nupkg_url = 'https://api.nuget.org/v3-flatcontainer/testpackage/1.0.0/testpackage.1.0.0.nupkg'
+            mock_session.get.return_value = Mock(status_code=200, content=b'nupkg', headers={})
+            http_get(nupkg_url)
+            mock_session.get.reset_mock()
+            self.assertEqual(http_get(nupkg_url), (200, b'nupkg'))
+            mock_session.get.assert_not_called()
+
+    @patch('dependency_visualizer.SESSION')
+    def test_http_get_serves_fresh_response_without_request(self, mock_session):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            set_cache_dir(cache_dir)
+            self.addCleanup(set_cache_dir, None)
+            url = 'https://api.nuget.org/v3/index.json'
+
+            mock_session.get.return_value = Mock(
+                status_code=200, content=b'{}', headers={'ETag': '"abc"', 'Cache-Control': 'public, max-age=3600'}
+            )
+            http_get(url)
+            mock_session.get.reset_mock()
+
+            # В пределах max-age ответ берется из кэша без обращения к сети
+            self.assertEqual(http_get(url), (200, b'{}'))
+            mock_session.get.assert_not_called()
+
+    @patch('dependency_visualizer.SESSION')
+    def test_http_get_file_streams_nupkg(self, mock_session):
+        # Сервер без поддержки Range отвечает 200 на запрос конца файла: файл скачивается целиком
+        response = MagicMock(status_code=200, headers={})
+        response.iter_content.return_value = [b'nu', b'pkg']
+        mock_session.get.return_value.__enter__.return_value = response
+        url = 'https://api.nuget.org/v3-flatcontainer/testpackage/1.0.0/testpackage.1.0.0.nupkg'
+
+        status_code, nupkg_file = http_get_file(url)
+        with nupkg_file:
+            self.assertEqual((status_code, nupkg_file.read()), (200, b'nupkg'))
+        self.assertTrue(mock_session.get.call_args[1]['stream'])
+        mock_session.head.assert_not_called()
+
+    def _serve_ranges(self, mock_session, url, nupkg_bytes, transferred, extra=b''):
+        # Отвечает на Range-запросы к nupkg_bytes, добавляя к телу ответа extra
+        def serve_range(url, headers, timeout, stream=False):
+            first, last = headers['Range'][len('bytes='):].split('-')
+            if first:
+                start, end = int(first), int(last)
+            else:
+                start, end = max(len(nupkg_bytes) - int(last), 0), len(nupkg_bytes) - 1
+            transferred.append(end - start + 1)
+            content = nupkg_bytes[start:end + 1]
+            response = MagicMock(
+                status_code=206, url=url, content=content + (extra if first else b''),
+                headers={'Content-Range': f'bytes {start}-{end}/{len(nupkg_bytes)}'}
+            )
+            response.__enter__.return_value = response
+            return response
+
+        mock_session.get.side_effect = serve_range
+
+    def _large_nupkg(self):
+        nuspec_content = '''<?xml version="1.0"?>
+        <package>
+          <metadata>
+            <dependencies>
+              <dependency id="Serilog" version="2.10.0" />
+            </dependencies>
+          </metadata>
+        </package>'''
+        nupkg = BytesIO()
+        with zipfile.ZipFile(nupkg, 'w') as z:
+            z.writestr('package.nuspec', nuspec_content)
+            z.writestr('lib/net45/package.dll', b'\0' * (4 * 1024 * 1024), compress_type=zipfile.ZIP_STORED)
+        return nupkg.getvalue()
+
+    @patch('dependency_visualizer.SESSION')
+    def test_http_get_file_reads_only_nuspec(self, mock_session):
+        url = 'https://api.nuget.org/v3-flatcontainer/testpackage/1.0.0/testpackage.1.0.0.nupkg'
+        transferred = []
+        self._serve_ranges(mock_session, url, self._large_nupkg(), transferred)
+
+        status_code, nupkg_file = http_get_file(url)
+        with nupkg_file:
+            self.assertEqual((status_code, extract_dependencies(nupkg_file)), (200, ['Serilog']))
+        # Из архива размером более 4 МБ скачаны только конец файла с центральным каталогом и запись .nuspec,
+        # а размер файла и поддержка Range узнаны из первого ответа без отдельного HEAD
+        self.assertLess(sum(transferred), 256 * 1024)
+        mock_session.head.assert_not_called()
+
+    @patch('dependency_visualizer.SESSION')
+    def test_http_get_file_rejects_oversized_range(self, mock_session):
+        url = 'https://api.nuget.org/v3-flatcontainer/testpackage/1.0.0/testpackage.1.0.0.nupkg'
+        self._serve_ranges(mock_session, url, self._large_nupkg(), [], extra=b'unexpected')
+
+        _, nupkg_file = http_get_file(url)
+        with nupkg_file, self.assertRaises(OSError):
+            extract_dependencies(nupkg_file)
+
+    @patch('dependency_visualizer.http_get_file')
+    def test_fetch_nupkg_dependencies_cached(self, mock_http_get_file):
+        nupkg = BytesIO()
+        with zipfile.ZipFile(nupkg, 'w') as z:
+            z.writestr('testpackage.nuspec', '<package><metadata><dependencies>'
+                                             '<dependency id="Serilog" /></dependencies></metadata></package>')
+        nupkg.seek(0)
+        mock_http_get_file.return_value = (200, nupkg)
+        base_address = 'https://api.nuget.org/v3-flatcontainer'
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            set_cache_dir(cache_dir)
+            self.addCleanup(set_cache_dir, None)
+            self.assertEqual(fetch_nupkg_dependencies('testpackage', '1.0.0', base_address), ['Serilog'])
+            # Сам архив не кэшируется, а извлеченные зависимости отдаются с диска без обращения к сети
+            self.assertEqual(fetch_nupkg_dependencies('testpackage', '1.0.0', base_address), ['Serilog'])
+            mock_http_get_file.assert_called_once()
 
     def test_generate_dot(self):
         graph = {
@@ -117,6 +496,21 @@ class TestDependencyVisualizer(unittest.TestCase):
         result_dot = generate_dot(graph)
         self.assertEqual(result_dot.strip(), expected_dot.strip())
 
+    def test_generate_dot_escapes_names(self):
+        graph = {'Package"A': ['Package\\B']}
+        expected_dot = 'digraph Dependencies {\n    "Package\\"A" -> "Package\\\\B";\n}'
+        self.assertEqual(generate_dot(graph), expected_dot)
+
+    def test_write_dot(self):
+        graph = {'PackageA': ['PackageB'], 'PackageB': []}
+        output = StringIO()
+        write_dot(graph, output)
+        self.assertEqual(output.getvalue(), generate_dot(graph))
+        self.assertEqual(output.getvalue(), 'digraph Dependencies {\n    "PackageA" -> "PackageB";\n}')
+
+    def test_generate_dot_empty_graph(self):
+        self.assertEqual(generate_dot({}), "digraph Dependencies {\n}")
+
 
 if __name__ == 'main':
     unittest.main()
\ No newline at end of file